@@ -1,17 +1,22 @@
 # app.py
 import os
+import re
 import time
 import logging
+import orjson
+from cachetools import TTLCache
 from dotenv import load_dotenv
-from flask import Flask, request, jsonify, make_response
+from flask import Flask, request, make_response
+from flask.json.provider import JSONProvider
 from flask_pymongo import PyMongo
 from bson.objectid import ObjectId
 from bson.errors import InvalidId
+from bson.raw_bson import RawBSONDocument
+from bson.codec_options import CodecOptions
 from pymongo import ReturnDocument
-from flask_cors import CORS
 from datetime import datetime
 
-from auth import requires_auth, requires_admin, register_auth_error_handlers
+from auth import requires_auth, requires_admin, register_auth_error_handlers, start_jwks_refresher
 
 # ---------------------------------------------------------------------
 # Configuração inicial
@@ -19,15 +24,64 @@ from auth import requires_auth, requires_admin, register_auth_error_handlers
 load_dotenv()
 app = Flask(__name__)
 
-# logging
-logging.basicConfig(level=logging.DEBUG)
-app.logger.setLevel(logging.DEBUG)
+# request.get_json() (e qualquer jsonify remanescente) via orjson
+class OrjsonProvider(JSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NAIVE_UTC).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+# logging: INFO por padrão; LOG_LEVEL=DEBUG em dev para ver os requests
+_log_level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+logging.basicConfig(level=_log_level)
+app.logger.setLevel(_log_level)
 
 # ---------------------------------------------------------------------
 # Configuração do MongoDB
 # ---------------------------------------------------------------------
 app.config["MONGO_URI"] = os.getenv("MONGO_URI", "mongodb://localhost:27017/pfzambomdb")
-mongo = PyMongo(app)
+# pool e timeouts explícitos: os defaults do driver deixam threads
+# esperando socket sob concorrência e sem teto de tempo por operação.
+# zstd comprime os frames BSON das listagens (~2-3x menos banda).
+mongo = PyMongo(
+    app,
+    maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", "200")),
+    minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", "20")),
+    socketTimeoutMS=int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "3000")),
+    serverSelectionTimeoutMS=int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "2000")),
+    compressors=os.getenv("MONGO_COMPRESSORS", "zstd"),
+)
+
+# precisa vir DEPOIS do PyMongo(app): o init_app dele instala um
+# BSONProvider em app.json que sobrescreveria o provider orjson.
+# (também significa abrir mão do hook de extended-JSON do BSONProvider
+# no get_json, que nenhuma rota usa)
+app.json = OrjsonProvider(app)
+
+# handles "raw": devolvem RawBSONDocument (bytes BSON sem decodificar),
+# e só os campos que a listagem usa são materializados em Python
+_RAW_OPTS = CodecOptions(document_class=RawBSONDocument)
+raw_investors = mongo.db.investors.with_options(codec_options=_RAW_OPTS)
+raw_trips = mongo.db.trips.with_options(codec_options=_RAW_OPTS)
+
+# garante os índices em todo deploy — workers do gunicorn não passam
+# pelo bloco __main__, então criar lá não basta
+with app.app_context():
+    try:
+        # migra created_at legado (BSON date) para epoch millis: datas
+        # ordenam acima de qualquer número no BSON, então sem isso os
+        # docs antigos ficariam sempre no topo do sort descendente
+        _to_millis = [{"$set": {"created_at": {"$toLong": "$created_at"}}}]
+        mongo.db.investors.update_many({"created_at": {"$type": "date"}}, _to_millis)
+        mongo.db.trips.update_many({"created_at": {"$type": "date"}}, _to_millis)
+
+        mongo.db.investors.create_index([("created_at", -1)])
+        mongo.db.trips.create_index([("created_at", -1)])
+        mongo.db.investors.create_index("idempotency_key", unique=True, sparse=True)
+        mongo.db.trips.create_index("idempotency_key", unique=True, sparse=True)
+    except Exception as e:
+        app.logger.warning("Falha ao criar índices/migrar created_at: %s", e)
 
 # ---------------------------------------------------------------------
 # CORS (FRONTEND_ORIGINS ou CORS_ORIGINS)
@@ -39,19 +93,29 @@ if _raw_origins == "*" or _raw_origins.lower() == "any":
 else:
     cors_origins = [o.strip() for o in _raw_origins.split(",") if o.strip()]
 
-CORS(
-    app,
-    resources={r"/*": {"origins": cors_origins}},
-    supports_credentials=True,
-    methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Content-Type", "Authorization", "Accept", "Idempotency-Key"],
-)
+_origins_set = frozenset(cors_origins) if isinstance(cors_origins, list) else None
+_ALLOW_METHODS = "GET,POST,PUT,DELETE,OPTIONS"
+_ALLOW_HEADERS = "Authorization,Content-Type,Accept,Idempotency-Key"
+
+# injeção manual dos headers CORS nas respostas normais; o preflight
+# OPTIONS já é respondido por handle_preflight sem passar pelas rotas
+@app.after_request
+def add_cors_headers(resp):
+    origin = request.headers.get("Origin")
+    if cors_origins == "*" or (origin and origin in _origins_set):
+        resp.headers["Access-Control-Allow-Origin"] = origin or "*"
+        resp.headers["Access-Control-Allow-Credentials"] = "true"
+        resp.headers["Vary"] = "Origin"
+    return resp
 
 # ---------------------------------------------------------------------
 # Registro de handlers de erro do Auth0
 # ---------------------------------------------------------------------
 register_auth_error_handlers(app)
 
+# pré-carrega o JWKS e mantém refresh periódico em background
+start_jwks_refresher()
+
 # ---------------------------------------------------------------------
 # Preflight OPTIONS rápido
 # ---------------------------------------------------------------------
@@ -64,17 +128,17 @@ def handle_preflight():
     allowed_origin = None
 
     if cors_origins == "*":
-        allowed_origin = "*" if origin else "*"
+        allowed_origin = "*"
     else:
-        if origin and origin in cors_origins:
+        if origin and origin in _origins_set:
             allowed_origin = origin
 
     resp = make_response("", 204)
     if allowed_origin:
         resp.headers["Access-Control-Allow-Origin"] = allowed_origin
         resp.headers["Vary"] = "Origin"
-        resp.headers["Access-Control-Allow-Methods"] = "GET,POST,PUT,DELETE,OPTIONS"
-        resp.headers["Access-Control-Allow-Headers"] = "Authorization,Content-Type,Accept,Idempotency-Key"
+        resp.headers["Access-Control-Allow-Methods"] = _ALLOW_METHODS
+        resp.headers["Access-Control-Allow-Headers"] = _ALLOW_HEADERS
         resp.headers["Access-Control-Allow-Credentials"] = "true"
         resp.headers["Access-Control-Max-Age"] = "3600"
     return resp
@@ -84,10 +148,16 @@ def handle_preflight():
 # ---------------------------------------------------------------------
 @app.before_request
 def log_request_info():
+    # em produção (INFO) isso custa só o isEnabledFor
+    if not app.logger.isEnabledFor(logging.DEBUG):
+        return
     if request.method == "OPTIONS":
         return
-    hdrs = {k: v for k, v in request.headers.items() if k in ("Host", "Origin", "Content-Type")}
-    body_preview = request.get_data(as_text=True)[:500] if request.data else ""
+    headers = request.headers
+    hdrs = {k: headers[k] for k in ("Host", "Origin", "Content-Type") if k in headers}
+    # fatia os bytes antes de decodificar, para não decodificar o corpo inteiro
+    raw = request.get_data(cache=True)
+    body_preview = raw[:500].decode("utf-8", "replace") if raw else ""
     app.logger.debug("Incoming request: %s %s headers=%s body_preview=%s", request.method, request.path, hdrs, body_preview)
 
 
@@ -96,28 +166,83 @@ def log_request_info():
 # ---------------------------------------------------------------------
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok", "service": "pf-zambom-back"}), 200
+    return oj({"status": "ok", "service": "pf-zambom-back"})
 
 @app.route("/ready", methods=["GET"])
 def ready():
     try:
         mongo.db.command("ping")
-        return jsonify({"ready": True}), 200
+        return oj({"ready": True})
     except Exception:
-        return jsonify({"ready": False}), 503
+        return oj({"ready": False}, 503)
 
 # ---------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------
-def serialize_doc(doc):
-    # converte ObjectId e datetimes para strings
-    doc = dict(doc)
-    if "_id" in doc:
-        doc["_id"] = str(doc["_id"])
-    for k, v in list(doc.items()):
-        if isinstance(v, datetime):
-            doc[k] = v.isoformat()
-    return doc
+def _bytes_response(body, status=200):
+    # Content-Length explícito: sem chunked framing, keep-alive direto
+    return app.response_class(
+        body,
+        status=status,
+        mimetype="application/json",
+        headers={"Content-Length": str(len(body))},
+    )
+
+def oj(obj, status=200):
+    # resposta JSON via orjson: datetimes viram RFC 3339 nativamente e
+    # default=str cobre ObjectId (e qualquer outro tipo não-JSON)
+    return _bytes_response(orjson.dumps(obj, default=str, option=orjson.OPT_NAIVE_UTC), status)
+
+def _list_pipeline(fields, date_fields=()):
+    # ordena, projeta só os campos que o frontend usa e converte
+    # _id/datas para string no próprio MongoDB, para o cursor já chegar
+    # menor e pronto para serializar.
+    # created_at é epoch millis (int) e passa direto, sem conversão.
+    to_str = {"_id": {"$toString": "$_id"}}
+    for f in date_fields:
+        to_str[f] = {"$dateToString": {"date": f"${f}"}}
+    return [
+        {"$sort": {"created_at": -1}},
+        {"$project": {f: 1 for f in fields}},
+        {"$addFields": to_str},
+    ]
+
+# valida YYYY-MM-DD sem pagar fromisoformat nem exceção no input ruim
+_DATE_RE = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+
+_INVESTOR_FIELDS = ("_id", "name", "corretora", "valor_investido", "perfil", "created_at")
+_TRIP_FIELDS = ("_id", "titulo", "destino", "data_inicio", "data_fim", "preco", "created_at")
+
+def _stream_json(cursor, fields):
+    # gera o array JSON documento a documento, direto do cursor:
+    # memória limitada ao batch e primeiro byte sai antes do fim da query.
+    # Só os campos conhecidos são materializados de cada documento raw.
+    yield b"["
+    first = True
+    for doc in cursor:
+        if not first:
+            yield b","
+        first = False
+        yield orjson.dumps({f: doc[f] for f in fields if f in doc}, default=str)
+    yield b"]"
+
+# cache curto das listagens já serializadas, chaveado pela coleção;
+# POST/DELETE na coleção invalidam. Absorve rajadas de GETs repetidos.
+_RESP_CACHE = TTLCache(maxsize=16, ttl=int(os.getenv("LIST_CACHE_TTL", "2")))
+
+def _cached_list_response(cache_key, make_cursor, fields):
+    body = _RESP_CACHE.get(cache_key)
+    if body is not None:
+        return _bytes_response(body)
+
+    def gen():
+        chunks = []
+        for chunk in _stream_json(make_cursor(), fields):
+            chunks.append(chunk)
+            yield chunk
+        _RESP_CACHE[cache_key] = b"".join(chunks)
+
+    return app.response_class(gen(), mimetype="application/json")
 
 # ---------------------------------------------------------------------
 # Rotas: INVESTIDORES
@@ -125,9 +250,11 @@ def serialize_doc(doc):
 @app.route("/investors", methods=["GET"])
 @requires_auth()
 def list_investors():
-    cursor = mongo.db.investors.find().sort("created_at", -1)
-    items = [serialize_doc(i) for i in cursor]
-    return jsonify(items), 200
+    return _cached_list_response(
+        "investors",
+        lambda: raw_investors.aggregate(_list_pipeline(_INVESTOR_FIELDS), allowDiskUse=False).batch_size(500),
+        _INVESTOR_FIELDS,
+    )
 
 @app.route("/investors", methods=["POST"])
 @requires_auth()
@@ -138,35 +265,46 @@ def create_investor():
     valor = data.get("valor_investido") or data.get("valor")
     perfil = data.get("perfil")
     if not (name and corretora and valor and perfil):
-        return jsonify({"error": "Campos obrigatórios: name, corretora, valor_investido, perfil"}), 400
+        return oj({"error": "Campos obrigatórios: name, corretora, valor_investido, perfil"}, 400)
     try:
         valor_float = float(valor)
     except Exception:
-        return jsonify({"error": "valor_investido deve ser numérico"}), 400
+        return oj({"error": "valor_investido deve ser numérico"}, 400)
 
     doc = {
         "name": name,
         "corretora": corretora,
         "valor_investido": valor_float,
         "perfil": perfil,
-        "created_at": datetime.utcnow()
+        "created_at": int(time.time() * 1000)
     }
-    inserted = mongo.db.investors.insert_one(doc)
-    doc["_id"] = str(inserted.inserted_id)
-    doc["created_at"] = doc["created_at"].isoformat()
-    return jsonify(doc), 201
+    idem_key = request.headers.get("Idempotency-Key")
+    if idem_key:
+        # retries com a mesma chave devolvem o doc já inserido
+        # (índice único sparse em idempotency_key garante a corrida)
+        doc["idempotency_key"] = idem_key
+        doc = mongo.db.investors.find_one_and_update(
+            {"idempotency_key": idem_key},
+            {"$setOnInsert": doc},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    else:
+        inserted = mongo.db.investors.insert_one(doc)
+        doc["_id"] = inserted.inserted_id
+    _RESP_CACHE.pop("investors", None)
+    return oj(doc, 201)
 
 @app.route("/investors/<id>", methods=["DELETE"])
 @requires_admin()
 def delete_investor(id):
-    try:
-        _id = ObjectId(id)
-    except Exception:
-        return jsonify({"error": "ID inválido"}), 400
-    res = mongo.db.investors.delete_one({"_id": _id})
+    if not ObjectId.is_valid(id):
+        return oj({"error": "ID inválido"}, 400)
+    res = mongo.db.investors.delete_one({"_id": ObjectId(id)})
     if res.deleted_count == 0:
-        return jsonify({"error": "Investidor não encontrado"}), 404
-    return jsonify({"message": "Investidor removido"}), 200
+        return oj({"error": "Investidor não encontrado"}, 404)
+    _RESP_CACHE.pop("investors", None)
+    return oj({"message": "Investidor removido"})
 
 # ---------------------------------------------------------------------
 # Rotas: VIAGENS (TRIPS)
@@ -174,9 +312,11 @@ def delete_investor(id):
 @app.route("/trips", methods=["GET"])
 @requires_auth()
 def list_trips():
-    cursor = mongo.db.trips.find().sort("created_at", -1)
-    items = [serialize_doc(i) for i in cursor]
-    return jsonify(items), 200
+    return _cached_list_response(
+        "trips",
+        lambda: raw_trips.aggregate(_list_pipeline(_TRIP_FIELDS, ["data_inicio", "data_fim"]), allowDiskUse=False).batch_size(500),
+        _TRIP_FIELDS,
+    )
 
 @app.route("/trips", methods=["POST"])
 @requires_auth()
@@ -188,13 +328,20 @@ def create_trip():
     data_fim = data.get("data_fim") or data.get("end_date")
     preco = data.get("preco") or data.get("price")
     if not (titulo and destino and data_inicio and data_fim and preco):
-        return jsonify({"error": "Campos obrigatórios: titulo, destino, data_inicio, data_fim, preco"}), 400
+        return oj({"error": "Campos obrigatórios: titulo, destino, data_inicio, data_fim, preco"}, 400)
+    m_inicio = _DATE_RE.match(data_inicio) if isinstance(data_inicio, str) else None
+    m_fim = _DATE_RE.match(data_fim) if isinstance(data_fim, str) else None
+    if not (m_inicio and m_fim):
+        return oj({"error": "Formato de data inválido (YYYY-MM-DD)"}, 400)
+    try:
+        dt_inicio = datetime(int(m_inicio[1]), int(m_inicio[2]), int(m_inicio[3]))
+        dt_fim = datetime(int(m_fim[1]), int(m_fim[2]), int(m_fim[3]))
+    except ValueError:
+        return oj({"error": "Formato de data inválido (YYYY-MM-DD)"}, 400)
     try:
-        dt_inicio = datetime.fromisoformat(data_inicio)
-        dt_fim = datetime.fromisoformat(data_fim)
         preco_f = float(preco)
-    except Exception:
-        return jsonify({"error": "Formato de data inválido (YYYY-MM-DD) ou preço inválido"}), 400
+    except (TypeError, ValueError):
+        return oj({"error": "preco deve ser numérico"}, 400)
 
     doc = {
         "titulo": titulo,
@@ -202,45 +349,45 @@ def create_trip():
         "data_inicio": dt_inicio,
         "data_fim": dt_fim,
         "preco": preco_f,
-        "created_at": datetime.utcnow()
+        "created_at": int(time.time() * 1000)
     }
-    inserted = mongo.db.trips.insert_one(doc)
-    doc["_id"] = str(inserted.inserted_id)
-    # convert datetimes to iso
-    doc["data_inicio"] = dt_inicio.isoformat()
-    doc["data_fim"] = dt_fim.isoformat()
-    doc["created_at"] = doc["created_at"].isoformat()
-    return jsonify(doc), 201
+    idem_key = request.headers.get("Idempotency-Key")
+    if idem_key:
+        doc["idempotency_key"] = idem_key
+        doc = mongo.db.trips.find_one_and_update(
+            {"idempotency_key": idem_key},
+            {"$setOnInsert": doc},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    else:
+        inserted = mongo.db.trips.insert_one(doc)
+        doc["_id"] = inserted.inserted_id
+    _RESP_CACHE.pop("trips", None)
+    return oj(doc, 201)
 
 @app.route("/trips/<id>", methods=["DELETE"])
 @requires_admin()
 def delete_trip(id):
-    try:
-        _id = ObjectId(id)
-    except Exception:
-        return jsonify({"error": "ID inválido"}), 400
-    res = mongo.db.trips.delete_one({"_id": _id})
+    if not ObjectId.is_valid(id):
+        return oj({"error": "ID inválido"}, 400)
+    res = mongo.db.trips.delete_one({"_id": ObjectId(id)})
     if res.deleted_count == 0:
-        return jsonify({"error": "Viagem não encontrada"}), 404
-    return jsonify({"message": "Viagem removida"}), 200
+        return oj({"error": "Viagem não encontrada"}, 404)
+    _RESP_CACHE.pop("trips", None)
+    return oj({"message": "Viagem removida"})
 
 # ---------------------------------------------------------------------
 # Index / root
 # ---------------------------------------------------------------------
 @app.route("/", methods=["GET"])
 def index():
-    return jsonify({"message": "API PF-Zambom funcionando"}), 200
+    return oj({"message": "API PF-Zambom funcionando"})
 
 # ---------------------------------------------------------------------
-# Inicialização: cria índices
+# Inicialização (dev)
 # ---------------------------------------------------------------------
 if __name__ == "__main__":
-    try:
-        mongo.db.investors.create_index([("created_at", -1)])
-        mongo.db.trips.create_index([("created_at", -1)])
-    except Exception as e:
-        app.logger.warning("Falha ao criar índices iniciais: %s", e)
-
     port = int(os.getenv("PORT", 5000))
     debug = os.getenv("FLASK_DEBUG", "false").lower() in ("1", "true", "yes")
     app.run(host="0.0.0.0", port=port, debug=debug)
@@ -1,34 +1,81 @@
 # auth.py
 import os
 import json
+import hashlib
+import logging
+import threading
+import time
 import requests
 from functools import wraps
-from flask import request, jsonify, abort, current_app
+from cachetools import TTLCache
+from flask import request, jsonify, abort
 from jose import jwt
 from jose.exceptions import JWTError, ExpiredSignatureError
 
+logger = logging.getLogger(__name__)
+
 AUTH0_DOMAIN = os.getenv("AUTH0_DOMAIN", "")
 API_AUDIENCE = os.getenv("API_AUDIENCE", "")
 ALGORITHMS = ["RS256"]
 
+JWKS_REFRESH_SECONDS = int(os.getenv("JWKS_REFRESH_SECONDS", "600"))
+
+# cache de payloads já verificados, chaveado por hash do token:
+# evita repetir a verificação RSA para o mesmo bearer (caso comum de SPA).
+# O TTL limita a janela mesmo se o exp do token for longo.
+_TOKEN_CACHE = TTLCache(maxsize=4096, ttl=300)
+
 _jwks_cache = None
+_jwks_lock = threading.Lock()
+_jwks_etag = None
+_jwks_session = requests.Session()
+
+def _fetch_jwks():
+    """Busca o JWKS no Auth0, indexa por kid e troca o cache atomicamente
+    (ETag evita baixar o corpo quando nada mudou)."""
+    global _jwks_cache, _jwks_etag
+    jwks_url = f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
+    headers = {"If-None-Match": _jwks_etag} if _jwks_etag else {}
+    try:
+        r = _jwks_session.get(jwks_url, headers=headers, timeout=5)
+        if r.status_code == 304:
+            return
+        r.raise_for_status()
+        by_kid = {
+            k["kid"]: {
+                "kty": k.get("kty"),
+                "kid": k.get("kid"),
+                "use": k.get("use"),
+                "n": k.get("n"),
+                "e": k.get("e")
+            }
+            for k in r.json().get("keys", []) if "kid" in k
+        }
+        with _jwks_lock:
+            _jwks_cache = by_kid
+            _jwks_etag = r.headers.get("ETag")
+    except Exception as e:
+        logger.error("Erro ao buscar JWKS: %s", e)
+
+def _jwks_refresher():
+    while True:
+        time.sleep(JWKS_REFRESH_SECONDS)
+        _fetch_jwks()
 
 def get_jwks():
-    global _jwks_cache
     if _jwks_cache is None:
         if not AUTH0_DOMAIN:
-            current_app.logger.error("AUTH0_DOMAIN não configurado")
+            logger.error("AUTH0_DOMAIN não configurado")
             return None
-        jwks_url = f"https://{AUTH0_DOMAIN}/.well-known/jwks.json"
-        try:
-            r = requests.get(jwks_url, timeout=5)
-            r.raise_for_status()
-            _jwks_cache = r.json()
-        except Exception as e:
-            current_app.logger.error("Erro ao buscar JWKS: %s", e)
-            _jwks_cache = None
+        _fetch_jwks()
     return _jwks_cache
 
+def start_jwks_refresher():
+    """Pré-carrega o JWKS e dispara a thread daemon de refresh periódico,
+    para nenhuma request pagar o GET (nem o timeout de 5s) no caminho quente."""
+    get_jwks()
+    threading.Thread(target=_jwks_refresher, daemon=True).start()
+
 def _get_token_auth_header():
     auth = request.headers.get("Authorization", None)
     if not auth:
@@ -52,37 +99,34 @@ def requires_auth(required_scopes=None):
         @wraps(f)
         def wrapper(*args, **kwargs):
             token = _get_token_auth_header()
-            jwks = get_jwks()
-            if jwks is None:
-                abort(500, description="JWKS indisponível")
-            try:
-                unverified_header = jwt.get_unverified_header(token)
-            except JWTError:
-                abort(401, description="Invalid header.")
-            rsa_key = {}
-            for key in jwks.get("keys", []):
-                if key.get("kid") == unverified_header.get("kid"):
-                    rsa_key = {
-                        "kty": key.get("kty"),
-                        "kid": key.get("kid"),
-                        "use": key.get("use"),
-                        "n": key.get("n"),
-                        "e": key.get("e")
-                    }
-            if not rsa_key:
-                abort(401, description="Unable to find appropriate key")
-            try:
-                payload = jwt.decode(
-                    token,
-                    rsa_key,
-                    algorithms=ALGORITHMS,
-                    audience=API_AUDIENCE,
-                    issuer=f"https://{AUTH0_DOMAIN}/"
-                )
-            except ExpiredSignatureError:
-                abort(401, description="token expired")
-            except JWTError as e:
-                abort(401, description=f"Invalid token: {e}")
+            cache_key = hashlib.blake2b(token.encode(), digest_size=16).digest()
+            cached = _TOKEN_CACHE.get(cache_key)
+            if cached is not None and cached[1] > time.time():
+                payload = cached[0]
+            else:
+                jwks = get_jwks()
+                if jwks is None:
+                    abort(500, description="JWKS indisponível")
+                try:
+                    unverified_header = jwt.get_unverified_header(token)
+                except JWTError:
+                    abort(401, description="Invalid header.")
+                rsa_key = jwks.get(unverified_header.get("kid"))
+                if not rsa_key:
+                    abort(401, description="Unable to find appropriate key")
+                try:
+                    payload = jwt.decode(
+                        token,
+                        rsa_key,
+                        algorithms=ALGORITHMS,
+                        audience=API_AUDIENCE,
+                        issuer=f"https://{AUTH0_DOMAIN}/"
+                    )
+                except ExpiredSignatureError:
+                    abort(401, description="token expired")
+                except JWTError as e:
+                    abort(401, description=f"Invalid token: {e}")
+                _TOKEN_CACHE[cache_key] = (payload, payload.get("exp", 0))
 
             # optional scope check (if provided)
             if required_scopes:
@@ -102,16 +146,21 @@ def requires_auth(required_scopes=None):
         return wrapper
     return decorator
 
+# permissions RBAC e claims namespaced de roles, configuráveis por env;
+# congelados no import para a checagem de admin ser O(1) por lookup
+ADMIN_PERMS = frozenset(p.strip() for p in os.getenv("ADMIN_PERMS", "delete:trip,delete:investor").split(",") if p.strip())
+ROLE_CLAIMS = tuple(c.strip() for c in os.getenv("ROLE_CLAIMS", "https://pfzambom/roles").split(",") if c.strip())
+
 def is_admin_from_payload(payload):
     """
     Detecta admin a partir do payload do token.
-    Ajuste conforme seu Auth0 (roles em namespaced claim, permissions, etc).
+    Ajuste ADMIN_PERMS/ROLE_CLAIMS conforme seu Auth0.
     """
     if not payload:
         return False
     # 1) permissions RBAC
-    perms = payload.get("permissions", []) or []
-    if isinstance(perms, list) and ("delete:trip" in perms or "delete:investor" in perms):
+    perms = payload.get("permissions") or ()
+    if not ADMIN_PERMS.isdisjoint(perms):
         return True
     # 2) roles field
     roles = payload.get("roles") or payload.get("role")
@@ -119,11 +168,11 @@ def is_admin_from_payload(payload):
         roles = [roles]
     if isinstance(roles, list) and any(r.lower() == "admin" for r in roles):
         return True
-    # 3) namespaced custom claim: .../roles
-    for k, v in payload.items():
-        if isinstance(k, str) and k.endswith("/roles"):
-            if isinstance(v, list) and any(r.lower() == "admin" for r in v):
-                return True
+    # 3) claims namespaced conhecidos (sem varrer o payload inteiro)
+    for claim in ROLE_CLAIMS:
+        v = payload.get(claim)
+        if v and any(r.lower() == "admin" for r in v):
+            return True
     return False
 
 def requires_admin():
@@ -0,0 +1,5 @@
+# wsgi.py
+# Entrypoint para gunicorn: gunicorn -k gevent -w 4 wsgi:application
+from app import app
+
+application = app